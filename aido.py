@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 import os
+import io
 import sys
-import json
+import stat
 import logging
-import clipboard
 from dotenv import load_dotenv
 from rich.console import Console
 from rich.panel import Panel
@@ -11,6 +11,9 @@ from rich.syntax import Syntax
 from rich.text import Text
 from rich.prompt import Confirm
 from chat_session import ChatSession
+from command_validator import has_errors
+from response_parser import ParsedResponse
+from stdin_reducer import StdinReducer
 from updater import UpdateManager
 
 console = Console()
@@ -67,36 +70,128 @@ def setup_logging(level=None):
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-def handle_single_query(query):
+def parse_args(argv):
+    """解析命令行参数
+
+    只识别出现在查询之前的选项，其余内容都作为查询文本。
+
+    Returns:
+        (查询文本, 选项字典)
+    """
+    options = {'grep': None, 'dedup': False, 'terse': None, 'explain': False, 'candidates': 1,
+               'stdin': False}
+    args = list(argv)
+    while args and args[0].startswith('--'):
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        if arg == '--grep' and args:
+            options['grep'] = args.pop(0)
+        elif arg.startswith('--grep='):
+            options['grep'] = arg.split('=', 1)[1]
+        elif arg == '--dedup':
+            options['dedup'] = True
+        elif arg == '--stdin':
+            options['stdin'] = True
+        elif arg == '--terse':
+            options['terse'] = True
+        elif arg == '--explain':
+            options['explain'] = True
+        elif arg == '--candidates' and args and args[0].isdigit():
+            options['candidates'] = int(args.pop(0))
+        elif arg.startswith('--candidates=') and arg.split('=', 1)[1].isdigit():
+            options['candidates'] = int(arg.split('=', 1)[1])
+        else:
+            args.insert(0, arg)
+            break
+    return ' '.join(args), options
+
+def has_piped_input(options):
+    """判断标准输入是否有通过管道或重定向传入的数据
+
+    stdin 不是终端并不代表有数据（例如 ssh 不带 -t、CI 或编辑器中运行），
+    只有管道或普通文件才读取。Windows 下 mintty 的终端本身就是管道，
+    因此需要用 --stdin 显式开启。
+    """
+    if options['stdin']:
+        return True
+    if os.name == 'nt':
+        return False
+    try:
+        mode = os.fstat(sys.stdin.fileno()).st_mode
+    except (OSError, ValueError):
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISREG(mode)
+
+def read_piped_input(chat, query, options):
+    """分块处理通过管道传入的标准输入，返回附加到查询中的上下文"""
+    model = chat.router.fast_model if chat.router.enabled else chat.model
+    reducer = StdinReducer(chat.client, model, query,
+                           pattern=options['grep'], dedup=options['dedup'],
+                           usage=chat.usage)
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
+    try:
+        return reducer.reduce(stream)
+    finally:
+        # 分离包装器，避免其被回收时关闭 sys.stdin
+        stream.detach()
+
+def handle_single_query(query, options=None):
     """处理单次查询"""
-    chat = ChatSession()
+    options = options or parse_args([])[1]
+    chat = ChatSession(terse=options['terse'], candidates=options['candidates'])
     
     # 显示用户查询
     chat._display_message(query, is_user=True)
     
+    # 管道输入先在本地分块归并，再随查询一起发送
+    content = query
+    if has_piped_input(options):
+        context = read_piped_input(chat, query, options)
+        if context:
+            content = f"{query}\n\n以下是通过管道输入的数据（或从中提取的关键信息）：\n{context}"
+    
     # 添加用户查询到消息历史
-    chat.messages.append({"role": "user", "content": query})
+    chat._add_user_message(content, query)
+    
+    # 多候选模式：并行生成后单键选择
+    if chat.candidates > 1:
+        chosen = chat.choose_candidate()
+        if chosen:
+            chat.copy_to_clipboard(chosen.command)
+            chat.save_history(ParsedResponse([chosen], chat.messages[-1]["content"]))
+        else:
+            chat.clear_history()
+        return
     
     # 获取AI响应
-    response = chat._get_ai_response()
+    response, validation = chat._get_validated_response()
     
-    # 尝试解析JSON并提取命令
-    try:
-        data = json.loads(response.strip())
-        command = data.get('command', '')
-        
-        # 复制命令到剪贴板
-        try:
-            clipboard.copy(command)
-            console.print(f"\n{INFO} [green]命令已复制到剪贴板[/green]")
-        except Exception as e:
-            logging.warning(f"复制到剪贴板失败: {str(e)}")
-            console.print(f"\n{WARNING} [yellow]复制到剪贴板失败[/yellow]")
-    except:
-        pass
+    # 复制第一条命令到剪贴板，优先选择通过本地校验的命令
+    commands = response.commands
+    if commands:
+        passing = [c for c in commands if not has_errors(validation.get(c))]
+        chat.copy_to_clipboard((passing or commands)[0])
     
     # 显示AI响应
-    chat._display_message(response)
+    chat._display_message(response, validation=validation)
+    
+    # 保存对话，供 aido --explain 使用
+    chat.messages.append({"role": "assistant", "content": response.raw})
+    chat.save_history(response)
+    if chat.terse and commands:
+        console.print("[dim]运行 aido --explain 查看命令解释[/dim]")
+
+def handle_explain():
+    """获取上一次单轮查询回答的解释"""
+    chat = ChatSession()
+    if not chat.load_history():
+        console.print(f"{WARNING} [yellow]没有找到上一次的查询记录[/yellow]")
+        return
+    # 解释成功后不再保留对话记录；请求失败时保留，便于重试
+    response = chat.explain_last()
+    if response and response.status != 'error':
+        chat.clear_history()
 
 def check_for_updates():
     """检查更新"""
@@ -116,8 +211,9 @@ def check_for_updates():
 
 def main():
     """主程序入口"""
-    # 检查更新
-    check_for_updates()
+    # 检查更新（标准输入被管道占用时无法交互确认，跳过）
+    if sys.stdin.isatty():
+        check_for_updates()
     
     # 设置日志
     setup_logging()
@@ -129,13 +225,19 @@ def main():
     
     try:
         # 检查是否有命令行参数
-        if len(sys.argv) > 1:
+        query, options = parse_args(sys.argv[1:])
+        if options['explain']:
+            # 按需获取上一条回答的解释
+            handle_explain()
+        elif query:
             # 单轮对话模式
-            query = ' '.join(sys.argv[1:])
-            handle_single_query(query)
+            handle_single_query(query, options)
+        elif has_piped_input(options):
+            console.print("[bold red]错误：使用管道输入时请提供查询内容，例如：journalctl | aido 哪个服务失败了[/bold red]")
+            return 1
         else:
             # 多轮对话模式
-            chat_session = ChatSession()
+            chat_session = ChatSession(terse=options['terse'], candidates=options['candidates'])
             chat_session.start()
             
     except Exception as e:
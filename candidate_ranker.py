@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+from typing import Dict, List, NamedTuple, Optional
+from response_parser import ParsedResponse, Suggestion
+from command_validator import ValidationIssue, has_errors
+
+
+class RankedCandidate(NamedTuple):
+    suggestion: Suggestion
+    votes: int
+    issues: Optional[List[ValidationIssue]]
+    score: float
+
+
+def normalize_command(command: str) -> str:
+    """统一空白字符，用于判断两条命令是否相同"""
+    return ' '.join(command.split())
+
+
+def rank_candidates(responses: List[ParsedResponse],
+                    validation: Optional[Dict[str, List[ValidationIssue]]] = None) -> List[RankedCandidate]:
+    """对多次生成的候选命令去重并在本地排序
+
+    排序依据：
+    - 多个候选之间的一致程度（相同命令出现的次数）
+    - 本地校验是否发现确定的错误（程序不存在、语法错误），选项提示不影响排序
+    - 命令长度，越短越好
+
+    Args:
+        responses: 每次生成解析后的回复
+        validation: 命令到本地校验问题列表的映射
+
+    Returns:
+        按分数从高到低排列的候选列表
+    """
+    validation = validation or {}
+    unique: Dict[str, Suggestion] = {}
+    votes: Dict[str, int] = {}
+    for response in responses:
+        # 同一次回复中的重复命令只计一票
+        seen = set()
+        for suggestion in response.suggestions:
+            key = normalize_command(suggestion.command)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            votes[key] = votes.get(key, 0) + 1
+            # 保留最先出现的命令写法和最完整的解释
+            current = unique.get(key)
+            if current is None:
+                unique[key] = suggestion
+            elif len(suggestion.explanation) > len(current.explanation):
+                unique[key] = current._replace(explanation=suggestion.explanation)
+
+    ranked = []
+    for key, suggestion in unique.items():
+        issues = validation.get(suggestion.command)
+        score = votes[key] * 2.0
+        if issues is not None:
+            score += 0 if has_errors(issues) else 3.0
+        score -= len(key) / 100
+        ranked.append(RankedCandidate(suggestion, votes[key], issues, round(score, 2)))
+    ranked.sort(key=lambda c: c.score, reverse=True)
+    return ranked
@@ -5,7 +5,10 @@ import logging
 import time
 import json
 import random
-from openai import OpenAI
+import platform
+import clipboard
+from concurrent.futures import ThreadPoolExecutor
+from openai import BadRequestError, OpenAI
 from rich.console import Console
 from rich.panel import Panel
 from rich.live import Live
@@ -14,22 +17,22 @@ from rich.text import Text
 from rich.style import Style
 from rich.spinner import Spinner
 from prompt_toolkit import prompt
+from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.styles import Style as PromptStyle
+from model_router import ModelRouter
+from response_parser import ParsedResponse, ResponseParser, Suggestion, supports_json_mode
+from command_validator import CommandValidator, has_errors
+from usage_tracker import UsageTracker
+from candidate_ranker import rank_candidates
 
-class ChatSession:
-    def __init__(self):
-        """初始化聊天会话"""
-        self.console = Console()
-        self.messages = [
-            {
-                "role": "system",
-                "content": """你是一个命令行专家，专门帮助用户解决各种命令行操作问题。请遵循以下规则：
+# 系统提示必须保持不变，任何按请求变化的内容都只能追加在消息末尾
+SYSTEM_PROMPT = """你是一个命令行专家，专门帮助用户解决各种命令行操作问题。请遵循以下规则：
 
 1. 仔细理解用户的意图，确保给出的命令准确解决用户的问题
-2. 返回JSON格式的响应，包含两个字段：command和explanation
+2. 返回一个JSON对象，格式为 {"commands": [{"command": "...", "explanation": "..."}]}
 3. command字段：
    - 提供准确的命令行指令
-   - 如果有多个可用命令，可以提供多个JSON响应
+   - 如果有多个可用命令，可以在commands列表中提供多项
    - 优先考虑通用性高的命令
    - 确保命令的正确性和安全性
 4. explanation字段：
@@ -38,10 +41,53 @@ class ChatSession:
    - 如果命令有潜在风险，要说明注意事项
 5. 根据用户的操作系统（Windows/MacOS/Linux）给出适合的命令
 6. 确保JSON格式的正确性，不要添加额外的markdown标记"""
-            }
+
+# 简洁模式下附加在用户问题之后的说明，只要求返回命令以缩短生成时间
+TERSE_INSTRUCTION = "（简洁模式：只返回命令，explanation 字段留空字符串）"
+
+# 多候选模式下并行请求使用的温度，温度越高候选越多样
+CANDIDATE_TEMPERATURES = [0.3, 0.7, 1.0, 0.5, 0.9, 1.2, 0.4, 0.8, 1.1]
+
+# 候选列表最多显示的条数，每条对应一个数字键
+MAX_CHOICES = 9
+
+# 按需获取上一条回答解释时发送的请求
+EXPLAIN_PROMPT = "请为你上一条回答中的每条命令补充中文解释，commands 列表中的命令保持不变，使用相同的JSON格式返回。"
+
+def environment_context():
+    """生成描述用户环境的系统消息，内容只取决于机器本身，不随时间变化"""
+    if os.name == 'nt':
+        shell = os.path.basename(os.getenv('COMSPEC', 'cmd.exe'))
+    else:
+        shell = os.path.basename(os.getenv('SHELL', 'sh'))
+    system = {'Darwin': 'MacOS'}.get(platform.system(), platform.system())
+    return f"用户环境：操作系统 {system}，Shell {shell}"
+
+class ChatSession:
+    def __init__(self, terse=None, candidates=1):
+        """初始化聊天会话
+
+        Args:
+            terse: 是否使用简洁模式，默认读取 TERSE_MODE 配置
+            candidates: 每次提问并行生成的候选数量，1 表示不使用多候选模式
+        """
+        self.console = Console()
+        self.terse = os.getenv('TERSE_MODE', 'false').lower() == 'true' if terse is None else terse
+        self.candidates = max(1, min(candidates, len(CANDIDATE_TEMPERATURES)))
+        aido_home = os.environ.get('AIDO_HOME') or os.path.dirname(os.path.abspath(__file__))
+        self.history_file = os.path.join(aido_home, '.last_session.json')
+        # 稳定的前缀（系统提示和环境信息）在每次请求中保持字节一致，便于命中服务端缓存
+        self.messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": environment_context()}
         ]
+        # 用户原始问题，不含简洁模式说明和管道数据，用于模型路由
+        self.current_query = None
         self.terminal_width = self.console.width
         self._init_client()
+        self.validator = CommandValidator()
+        self.usage = UsageTracker(self.console)
+        self.parser = ResponseParser()
         self.thinking_messages = [
             "容我三思...",
             "让我想想...",
@@ -72,55 +118,56 @@ class ChatSession:
         )
         
         self.model = model_name
+        self.router = ModelRouter(model_name)
+        self.json_mode = supports_json_mode(base_url)
 
-    def _format_ai_message(self, message):
-        """格式化AI消息"""
-        # 去除可能的markdown代码块标记
-        message = message.strip()
-        
-        # 分离出所有的JSON块
-        json_blocks = []
-        current_block = ""
-        lines = message.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line.startswith('```'):
-                if current_block:  # 结束当前块
-                    json_blocks.append(current_block.strip())
-                    current_block = ""
-                continue
-            current_block += line + "\n"
-        if current_block:  # 添加最后一个块
-            json_blocks.append(current_block.strip())
+    def _format_ai_message(self, response, validation=None):
+        """格式化AI消息
+
+        Args:
+            response: 解析后的AI回复
+            validation: 命令到本地校验问题列表的映射
+        """
+        validation = validation or {}
         
         # 创建格式化的文本
         formatted_text = Text()
         
-        # 处理每个JSON块
-        for i, block in enumerate(json_blocks):
-            try:
-                # 尝试解析JSON
-                data = json.loads(block)
-                command = data.get('command', '')
-                explanation = data.get('explanation', '')
-                
-                # 如果有多个命令，添加分隔符
-                if i > 0:
-                    formatted_text.append("\n\n" + "="*40 + "\n\n", style="dim")
-                
-                # 添加格式化的内容
-                formatted_text.append("【建议命令】\n", style="bold yellow")
-                formatted_text.append(f"{command}\n\n", style="bold white")
+        # 处理每条建议
+        for i, suggestion in enumerate(response.suggestions):
+            # 如果有多个命令，添加分隔符
+            if i > 0:
+                formatted_text.append("\n\n" + "="*40 + "\n\n", style="dim")
+            
+            # 添加格式化的内容
+            formatted_text.append("【建议命令】\n", style="bold yellow")
+            formatted_text.append(f"{suggestion.command}\n", style="bold white")
+            if suggestion.command in validation:
+                issues = validation[suggestion.command]
+                if issues:
+                    for issue in issues:
+                        if issue.fatal:
+                            formatted_text.append(f"⚠ {issue.message}\n", style="bold red")
+                        else:
+                            formatted_text.append(f"? {issue.message}\n", style="yellow")
+                else:
+                    formatted_text.append("✔ 本地校验通过\n", style="dim")
+            if suggestion.explanation:
+                formatted_text.append("\n")
                 formatted_text.append("【解释】\n", style="bold yellow")
-                formatted_text.append(explanation, style="white")
-            except json.JSONDecodeError:
-                # 如果解析失败，添加原始内容
-                if block.strip():
-                    formatted_text.append(block)
+                formatted_text.append(suggestion.explanation, style="white")
         
-        return formatted_text if formatted_text.plain else Text(message)
+        formatted_text.rstrip()
+        
+        # 无法解析为命令的内容按原文显示
+        if response.text:
+            if formatted_text.plain:
+                formatted_text.append("\n\n")
+            formatted_text.append(response.text)
+        
+        return formatted_text if formatted_text.plain else Text(response.raw)
 
-    def _create_message_panel(self, content, is_user=False):
+    def _create_message_panel(self, content, is_user=False, validation=None):
         """创建消息面板"""
         # 计算消息面板的宽度（终端宽度的70%）
         panel_width = min(int(self.terminal_width * 0.7), 100)
@@ -136,7 +183,9 @@ class ChatSession:
             text = Text(content)
             text.style = style
         else:
-            text = self._format_ai_message(content)
+            if not isinstance(content, ParsedResponse):
+                content = self.parser.parse(content)
+            text = self._format_ai_message(content, validation)
         
         # 创建面板
         return Panel(
@@ -148,9 +197,9 @@ class ChatSession:
             width=panel_width
         )
 
-    def _display_message(self, content, is_user=False):
+    def _display_message(self, content, is_user=False, validation=None):
         """显示消息"""
-        panel = self._create_message_panel(content, is_user)
+        panel = self._create_message_panel(content, is_user, validation)
         # 根据是用户还是AI消息，调整显示位置
         if is_user:
             self.console.print(Align(panel, align="right"))
@@ -158,8 +207,92 @@ class ChatSession:
             self.console.print(Align(panel, align="left"))
         self.console.print("")  # 添加空行
 
+    def copy_to_clipboard(self, command):
+        """复制命令到剪贴板"""
+        try:
+            clipboard.copy(command)
+            self.console.print("\nℹ️  [green]命令已复制到剪贴板[/green]")
+        except Exception as e:
+            logging.warning(f"复制到剪贴板失败: {str(e)}")
+            self.console.print("\n🚷 [yellow]复制到剪贴板失败[/yellow]")
+
+    def _add_user_message(self, content, query=None):
+        """添加用户消息，简洁模式下附加只返回命令的说明
+
+        Args:
+            content: 发送给模型的内容
+            query: 用户原始问题，默认与 content 相同
+        """
+        self.current_query = query if query is not None else content
+        if self.terse:
+            content = f"{content}\n{TERSE_INSTRUCTION}"
+        self.messages.append({"role": "user", "content": content})
+
+    def save_history(self, response):
+        """保存对话历史，供之后按需获取解释
+
+        对话中可能包含管道输入的数据，只在之后确实可能需要解释时保存
+        （简洁模式，或有命令缺少解释），文件仅当前用户可读写；
+        其余情况删除上一次遗留的记录。
+
+        Args:
+            response: 本次对话最后一条回复
+        """
+        needs_explain = self.terse or any(not s.explanation for s in response.suggestions)
+        if response.status == 'error' or not needs_explain:
+            self.clear_history()
+            return
+        try:
+            fd = os.open(self.history_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.messages, f, ensure_ascii=False)
+            # 已存在的文件不受 os.open 权限参数影响
+            os.chmod(self.history_file, 0o600)
+        except OSError as e:
+            logging.warning(f"保存对话历史失败: {e}")
+
+    def clear_history(self):
+        """删除保存的对话历史"""
+        try:
+            os.remove(self.history_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"删除对话历史失败: {e}")
+
+    def load_history(self):
+        """加载上一次保存的对话历史
+
+        Returns:
+            是否加载成功
+        """
+        try:
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                messages = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not messages or messages[-1].get("role") != "assistant":
+            return False
+        self.messages = messages
+        return True
+
+    def explain_last(self):
+        """获取并显示上一条回答的解释，复用已有的对话上下文
+
+        Returns:
+            解释的回复，没有可以解释的回答时为 None
+        """
+        if len(self.messages) < 2 or self.messages[-1]["role"] != "assistant":
+            self.console.print("[yellow]还没有可以解释的回答[/yellow]")
+            return None
+        self.messages.append({"role": "user", "content": EXPLAIN_PROMPT})
+        response = self._get_ai_response()
+        self._display_message(response)
+        self.messages.append({"role": "assistant", "content": response.raw})
+        return response
+
     def _get_ai_response(self):
-        """获取AI响应"""
+        """获取并解析AI响应"""
         # 随机选择一个思考消息
         thinking_msg = random.choice(self.thinking_messages)
         spinner = Spinner("dots2", style="green")
@@ -170,20 +303,247 @@ class ChatSession:
             
             # 获取AI响应
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=self.messages,
-                    temperature=0.3,
-                    stream=False
-                )
-                return response.choices[0].message.content
+                if self.router.enabled:
+                    return self._get_routed_response()
+                return self._create_completion(self.model)
             except Exception as e:
-                error_msg = f"API调用失败: {str(e)}\n提示：请检查 BASE_URL 和 MODEL_NAME 配置是否正确"
-                logging.error(error_msg)
-                return json.dumps({
-                    "command": "",
-                    "explanation": error_msg
-                }, ensure_ascii=False)
+                return self._api_error_response(e)
+
+    def _api_error_response(self, error):
+        """把API调用异常转换为显示给用户的回复"""
+        error_msg = f"API调用失败: {str(error)}\n提示：请检查 BASE_URL 和 MODEL_NAME 配置是否正确"
+        logging.error(error_msg)
+        return ParsedResponse([Suggestion("", error_msg)], error_msg, status='error')
+
+    def _create_completion(self, model, temperature=0.3):
+        """调用指定模型获取并解析回复，用量和解析结果一并记录
+
+        服务支持时使用 JSON 模式约束输出格式；服务拒绝该参数时关闭 JSON 模式后重试。
+        """
+        kwargs = {}
+        if self.json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        try:
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=self.messages,
+                temperature=temperature,
+                stream=False,
+                **kwargs
+            )
+        except BadRequestError as e:
+            # 只有与 response_format 相关的错误才说明服务不支持 JSON 模式，
+            # 上下文过长、模型名错误等其他 400 错误照常抛出
+            message = str(e).lower()
+            if not kwargs or not ('response_format' in message or 'json_object' in message):
+                raise
+            logging.warning(f"服务不支持 JSON 模式，改用容错解析: {e}")
+            self.json_mode = False
+            return self._create_completion(model, temperature)
+        parsed = self.parser.parse(response.choices[0].message.content)
+        self.usage.record(model, getattr(response, 'usage', None), parsed.status)
+        return parsed
+
+    def _route(self):
+        """按用户原始问题的复杂度选择模型
+
+        不使用最后一条消息的内容，因为其中可能附加了简洁模式说明或管道数据，
+        会让分数虚高。
+        """
+        query = self.current_query or self.messages[-1]["content"]
+        depth = sum(1 for m in self.messages[:-1] if m["role"] == "user")
+        return self.router.route(query, depth)
+
+    def _get_routed_response(self):
+        """按查询复杂度选择模型，快模型输出无效时自动升级"""
+        decision = self._route()
+
+        while decision:
+            start_time = time.time()
+            response = self._create_completion(decision["model"])
+            valid = bool(response.suggestions)
+            self.router.record(decision, time.time() - start_time, valid)
+            if valid:
+                return response
+            decision = self.router.escalate(decision)
+        return response
+
+    def _validate_commands(self, response):
+        """在线程池中并行校验回复中的所有命令
+
+        Returns:
+            命令到问题列表的映射
+        """
+        if not self.validator.enabled:
+            return {}
+        futures = {command: self.validator.submit(command)
+                   for command in response.commands}
+        results = {}
+        for command, future in futures.items():
+            try:
+                results[command] = future.result()
+            except Exception as e:
+                logging.warning(f"命令校验失败: {e}")
+        self.validator.save_cache()
+        return results
+
+    def _get_validated_response(self):
+        """获取AI响应并在本地校验命令，校验失败时自动请求修正一次
+
+        Returns:
+            (解析后的AI响应, 校验结果)
+        """
+        response = self._get_ai_response()
+        validation = self._validate_commands(response)
+        # 只有程序不存在、语法错误等确定的问题才请求修正，选项提示可能误报
+        if self.validator.auto_correct and any(has_errors(issues) for issues in validation.values()):
+            self.console.print("[dim]建议的命令未通过本地校验，正在请求修正...[/dim]")
+            self.messages.append({"role": "assistant", "content": response.raw})
+            self.messages.append({
+                "role": "user",
+                "content": self.validator.correction_prompt(validation)
+            })
+            response = self._get_ai_response()
+            validation = self._validate_commands(response)
+        return response, validation
+
+    def _request_candidates(self, model, temperatures):
+        """以不同温度并行请求多个候选
+
+        Returns:
+            (解析后的回复列表, 失败请求的异常列表)
+        """
+        responses, errors = [], []
+        with ThreadPoolExecutor(max_workers=len(temperatures)) as executor:
+            futures = [executor.submit(self._create_completion, model, t) for t in temperatures]
+            for future in futures:
+                try:
+                    responses.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+        return responses, errors
+
+    def _get_candidate_responses(self):
+        """并行请求多个候选，总耗时约等于一次请求
+
+        开启模型路由时记录路由决策，所有候选都无法解析时升级到强模型重试。
+
+        Returns:
+            解析后的回复列表；全部请求失败时只包含一条错误提示
+        """
+        decision = self._route() if self.router.enabled else None
+        temperatures = CANDIDATE_TEMPERATURES[:self.candidates]
+
+        thinking_msg = random.choice(self.thinking_messages)
+        with Live(Spinner("dots2", style="green"), refresh_per_second=10) as live:
+            live.update(Text(f"{thinking_msg}（并行生成 {self.candidates} 个候选）", style="bold green"))
+            while True:
+                start_time = time.time()
+                model = decision["model"] if decision else self.model
+                responses, errors = self._request_candidates(model, temperatures)
+                if not decision or not responses:
+                    break
+                valid = any(r.suggestions for r in responses)
+                self.router.record(dict(decision, candidates=len(temperatures)),
+                                   time.time() - start_time, valid)
+                decision = None if valid else self.router.escalate(decision)
+                if not decision:
+                    break
+
+        if not responses:
+            return [self._api_error_response(errors[0])]
+        if errors:
+            logging.warning(f"候选请求失败: {errors[0]}")
+            self.console.print(f"[yellow]{len(errors)} 个候选请求失败：{errors[0]}[/yellow]")
+        return responses
+
+    def _format_candidates(self, ranked):
+        """把排序后的候选格式化为编号列表"""
+        formatted_text = Text()
+        for i, candidate in enumerate(ranked, 1):
+            if i > 1:
+                formatted_text.append("\n\n")
+            formatted_text.append(f"[{i}] ", style="bold cyan")
+            formatted_text.append(f"{candidate.suggestion.command}\n", style="bold white")
+            notes = [f"{candidate.votes} 个候选一致"] if candidate.votes > 1 else []
+            if candidate.issues:
+                notes.extend(f"⚠ {issue.message}" if issue.fatal else f"? {issue.message}"
+                             for issue in candidate.issues)
+            elif candidate.issues is not None:
+                notes.append("✔ 本地校验通过")
+            if notes:
+                formatted_text.append("    " + "；".join(notes) + "\n", style="dim")
+            if candidate.suggestion.explanation:
+                formatted_text.append(f"    {candidate.suggestion.explanation}", style="white")
+        formatted_text.rstrip()
+        return formatted_text
+
+    def _pick_candidate(self, count):
+        """单键选择候选命令
+
+        Returns:
+            选中的序号（从 1 开始），取消时返回 None
+        """
+        if not sys.stdin.isatty():
+            return 1
+        bindings = KeyBindings()
+        for i in range(1, count + 1):
+            @bindings.add(str(i))
+            def _(event, i=i):
+                event.app.exit(result=i)
+
+        @bindings.add('enter')
+        def _(event):
+            event.app.exit(result=1)
+
+        @bindings.add('q')
+        @bindings.add('escape')
+        @bindings.add('c-c')
+        def _(event):
+            event.app.exit(result=None)
+
+        return prompt(
+            f'按 1-{count} 选择命令（回车选择第一条，q 取消）：',
+            style=self.prompt_style,
+            key_bindings=bindings
+        )
+
+    def choose_candidate(self):
+        """并行生成多个候选，去重排序后由用户单键选择
+
+        选中的命令会作为助手回复加入对话历史。
+
+        Returns:
+            选中的 Suggestion，没有候选或用户取消时返回 None
+        """
+        responses = self._get_candidate_responses()
+        combined = ParsedResponse([s for r in responses for s in r.suggestions], '')
+        # 每条回复可能包含多条命令，只保留能用数字键选择的前几名
+        ranked = rank_candidates(responses, self._validate_commands(combined))[:MAX_CHOICES]
+        if not ranked:
+            # 显示API错误或无法解析的回复原文
+            self._display_message(responses[0])
+            return None
+
+        panel_width = min(int(self.terminal_width * 0.7), 100)
+        self.console.print(Panel(
+            self._format_candidates(ranked),
+            title=f"😄 {time.strftime('%H:%M:%S')} 😄",
+            title_align="left",
+            border_style="green",
+            padding=(1, 2),
+            width=panel_width
+        ))
+        index = self._pick_candidate(len(ranked))
+        if index is None:
+            return None
+
+        chosen = ranked[index - 1].suggestion
+        self.messages.append({
+            "role": "assistant",
+            "content": json.dumps({"commands": [chosen._asdict()]}, ensure_ascii=False)
+        })
+        return chosen
 
     def start(self):
         """启动聊天会话"""
@@ -197,7 +557,10 @@ class ChatSession:
                 padding=(1, 2)
             )
             self.console.print(welcome_panel)
-            self.console.print("[dim]提示：按 Ctrl+C 结束对话[/dim]\n")
+            self.console.print("[dim]提示：按 Ctrl+C 结束对话[/dim]")
+            if self.terse:
+                self.console.print("[dim]简洁模式：输入 ? 查看上一条回答的解释[/dim]")
+            self.console.print("")
 
             while True:
                 try:
@@ -211,16 +574,36 @@ class ChatSession:
                     if not user_input.strip():
                         continue
                     
+                    # 按需获取上一条回答的解释
+                    if user_input.strip() == '?':
+                        self.explain_last()
+                        continue
+                    
                     # 显示用户消息
                     self._display_message(user_input, is_user=True)
                     
                     # 更新消息历史
-                    self.messages.append({"role": "user", "content": user_input})
+                    self._add_user_message(user_input)
+                    
+                    # 多候选模式：并行生成后单键选择
+                    if self.candidates > 1:
+                        try:
+                            chosen = self.choose_candidate()
+                        except Exception:
+                            # 出错时同样撤回本轮提问，避免对话历史中留下没有回复的提问
+                            self.messages.pop()
+                            raise
+                        if chosen:
+                            self.copy_to_clipboard(chosen.command)
+                        else:
+                            # 未选择任何命令，撤回本轮提问
+                            self.messages.pop()
+                        continue
                     
                     # 获取并显示AI响应
-                    ai_message = self._get_ai_response()
-                    self._display_message(ai_message)
-                    self.messages.append({"role": "assistant", "content": ai_message})
+                    ai_message, validation = self._get_validated_response()
+                    self._display_message(ai_message, validation=validation)
+                    self.messages.append({"role": "assistant", "content": ai_message.raw})
 
                 except Exception as e:
                     logging.error(f"处理消息时出错: {str(e)}")
@@ -236,13 +619,15 @@ class ChatSession:
             try:
                 # 发送告别消息
                 response = self.client.chat.completions.create(
-                    model="deepseek-chat",
+                    model=self.model,
                     messages=self.messages + [{"role": "user", "content": "再见，谢谢你的帮助！"}],
                     temperature=0.3,
                     stream=False
                 )
-                farewell_msg = response.choices[0].message.content
-                self._display_message(farewell_msg)
+                # 系统提示要求JSON格式，告别语同样需要解析后显示
+                farewell = self.parser.parse(response.choices[0].message.content)
             except:
-                self._display_message("感谢使用AIDO，再见！")
+                farewell_msg = "感谢使用AIDO，再见！"
+                farewell = ParsedResponse([], farewell_msg, farewell_msg)
+            self._display_message(farewell)
             sys.exit(0) 
\ No newline at end of file
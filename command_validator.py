@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import shlex
+import shutil
+import logging
+import threading
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+# 分隔简单命令的控制符
+CONTROL_OPERATORS = {'|', '||', '&&', ';', '&', '|&', '(', ')', ';;', '\n'}
+
+# 重定向符号，其后的词是文件名而不是程序
+REDIRECTIONS = {'>', '>>', '<', '<<', '<<<', '>&', '<&', '&>', '&>>', '>|'}
+
+# 不是外部程序、无需 which 查找的 shell 关键字和内建命令
+SHELL_BUILTINS = {
+    'cd', 'echo', 'export', 'source', '.', 'alias', 'unalias', 'set', 'unset',
+    'read', 'eval', 'exec', 'exit', 'return', 'shift', 'trap', 'type', 'wait',
+    'jobs', 'fg', 'bg', 'ulimit', 'umask', 'history', 'printf', 'test', '[',
+    '[[', ']]', 'true', 'false', 'local', 'declare', 'let', 'pushd', 'popd',
+    'dirs', 'builtin', 'command', 'hash', 'shopt', 'complete', 'getopts',
+    'readonly', 'times', 'disown', 'suspend', 'logout', 'caller', 'enable',
+    'help', 'mapfile', 'readarray', 'compgen', 'setopt', 'unsetopt', 'bindkey',
+    'autoload', 'print', 'rehash', 'where', 'which', 'function', 'break',
+    'continue'
+}
+
+# 出现在简单命令开头、其后才是真正程序的关键字
+LEADING_KEYWORDS = {'do', 'then', 'else', 'elif', 'if', 'while', 'until', '!', '{', 'time'}
+
+# 以这些关键字开头的片段不包含可检查的程序（end 是 fish 的块结束关键字）
+SKIPPED_KEYWORDS = {'for', 'case', 'select', 'done', 'fi', 'esac', '}', 'in', 'function', 'end'}
+
+# 支持 -n 只检查语法不执行的 shell
+SYNTAX_CHECK_SHELLS = {'bash', 'zsh', 'fish', 'sh', 'dash', 'ksh'}
+
+# 命令写法与 POSIX sh 一致、能可靠拆分出程序名的 shell，程序不存在视为确定的错误；
+# 其他 shell（fish、nu 等）只作为提示
+POSIX_SHELLS = {'bash', 'zsh', 'sh', 'dash', 'ksh'}
+
+# 括号在这些 shell 中还表示 glob 限定符或命令替换，拆分命令时不作为分隔符
+PAREN_WORD_SHELLS = {'zsh', 'fish'}
+
+# 包装其他程序执行的命令，及其需要带参数值的选项
+WRAPPERS = {
+    'sudo': {'-u', '-g', '-C', '-D', '-h', '-p', '-r', '-t', '-U'},
+    'doas': {'-u', '-C'},
+    'env': {'-u', '-C', '-S'},
+    'nice': {'-n'},
+    'nohup': set(),
+    'exec': {'-a'},
+    'command': set(),
+    'builtin': set()
+}
+
+# 只会为这些常见工具执行 --help 检查选项：它们没有子命令、--help 不会产生副作用、
+# 输出的是完整的选项列表，且 GNU 与 BSD 版本的选项差异较大。
+# 其他程序（尤其是本地脚本）一律不执行；curl、ps、jq 等帮助信息不完整的工具也不在其中
+HELP_TOOLS = {
+    'ls', 'cp', 'mv', 'ln', 'mkdir', 'cat', 'head', 'tail', 'sort', 'uniq',
+    'cut', 'tr', 'wc', 'du', 'df', 'find', 'xargs', 'grep', 'egrep', 'fgrep',
+    'sed', 'date', 'stat', 'touch', 'chmod', 'chown', 'readlink', 'realpath',
+    'basename', 'dirname', 'tar', 'gzip', 'gunzip', 'split', 'tee', 'seq',
+    'nl', 'paste', 'join', 'comm', 'diff', 'md5sum', 'sha1sum', 'sha256sum',
+    'base64', 'timeout', 'free', 'rsync', 'wget'
+}
+
+# 帮助信息中至少列出这么多长选项，才视为完整的选项列表
+MIN_HELP_OPTIONS = 3
+
+# 帮助信息缓存格式版本，判断规则变化时使旧缓存失效
+HELP_CACHE_VERSION = 2
+
+
+class ValidationIssue(NamedTuple):
+    message: str
+    # 程序不存在、语法错误等确定的问题；选项检查只是提示，可能误报
+    fatal: bool = True
+
+    def __str__(self):
+        return self.message
+
+
+def has_errors(issues: Optional[List[ValidationIssue]]) -> bool:
+    """校验结果中是否包含确定的错误"""
+    return any(issue.fatal for issue in issues or [])
+
+
+class CommandValidator:
+    def __init__(self, max_workers: int = 4):
+        """初始化命令校验器
+
+        Args:
+            max_workers: 并行校验的线程数
+        """
+        self.logger = logging.getLogger(__name__)
+        self.enabled = (os.name != 'nt'
+                        and os.getenv('VALIDATE_COMMANDS', 'true').lower() == 'true')
+        self.auto_correct = os.getenv('AUTO_CORRECT', 'false').lower() == 'true'
+        # 按用户实际使用的 shell 检查语法，不支持 -n 的 shell 不做语法检查
+        self.shell_name = os.path.basename(os.getenv('SHELL', '')) or 'sh'
+        self.shell = shutil.which(self.shell_name) if self.shell_name in SYNTAX_CHECK_SHELLS else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        aido_home = os.environ.get('AIDO_HOME') or os.path.dirname(os.path.abspath(__file__))
+        self.cache_file = os.path.join(aido_home, '.help_cache.json')
+        self._cache: Optional[Dict] = None
+        self._cache_dirty = False
+        self._lock = threading.Lock()
+
+    def submit(self, command: str) -> Future:
+        """提交一条命令到线程池进行校验
+
+        Returns:
+            结果为问题列表的 Future，列表为空表示校验通过
+        """
+        return self.executor.submit(self.validate, command)
+
+    def validate(self, command: str) -> List[ValidationIssue]:
+        """校验单条命令：语法、程序是否存在、选项是否受支持"""
+        if not command.strip():
+            return []
+        issues = []
+        syntax_error = self._check_syntax(command)
+        if syntax_error:
+            issues.append(ValidationIssue(syntax_error))
+        for argv in self._extract_invocations(command):
+            program = argv[0]
+            path = shutil.which(program)
+            if not path:
+                issues.append(ValidationIssue(f"未找到程序: {program}",
+                                              fatal=self.shell_name in POSIX_SHELLS))
+                continue
+            issues.extend(self._check_options(program, path, argv[1:]))
+        return issues
+
+    def _check_syntax(self, command: str) -> Optional[str]:
+        """使用用户 shell 的 -n 选项检查语法"""
+        if not self.shell:
+            return None
+        try:
+            result = subprocess.run(
+                [self.shell, '-n', '-c', command],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                timeout=3
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.logger.debug(f"语法检查失败: {e}")
+            return None
+        if result.returncode != 0:
+            message = result.stderr.strip().splitlines()
+            return f"语法错误: {message[-1] if message else '未知错误'}"
+        return None
+
+    def _extract_invocations(self, command: str) -> List[List[str]]:
+        """把命令拆分为简单命令，返回每个简单命令的参数列表"""
+        punctuation = '&;|<>' if self.shell_name in PAREN_WORD_SHELLS else True
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=punctuation)
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError:
+            return []
+
+        invocations, current = [], []
+        skip_next = False
+        for token in tokens:
+            if skip_next:
+                skip_next = False
+                continue
+            if token in CONTROL_OPERATORS:
+                invocations.append(current)
+                current = []
+            elif token in REDIRECTIONS or re.fullmatch(r'\d*[<>]+&?', token):
+                skip_next = True
+            else:
+                current.append(token)
+        invocations.append(current)
+
+        result = []
+        for argv in invocations:
+            argv = self._strip_prefix(argv)
+            if not argv or argv[0] in SHELL_BUILTINS:
+                continue
+            # 变量、命令替换和占位符无法在本地判断
+            if re.search(r'[$`{}<>*?()]', argv[0]):
+                continue
+            result.append(argv)
+        return result
+
+    def _strip_prefix(self, argv: List[str]) -> List[str]:
+        """去掉关键字、环境变量赋值和包装命令，定位真正执行的程序"""
+        while argv:
+            head = argv[0]
+            if head in SKIPPED_KEYWORDS:
+                return []
+            if head in LEADING_KEYWORDS or re.match(r'^[A-Za-z_]\w*=', head):
+                argv = argv[1:]
+            elif head in WRAPPERS:
+                arg_options = WRAPPERS[head]
+                argv = argv[1:]
+                while argv and (argv[0].startswith('-') or '=' in argv[0]):
+                    argv = argv[2:] if argv[0] in arg_options else argv[1:]
+            else:
+                break
+        return argv
+
+    def _check_options(self, program: str, path: str, args: List[str]) -> List[ValidationIssue]:
+        """对照 --help 输出检查长选项，发现 GNU/BSD 选项差异"""
+        # 只检查在 PATH 中找到的白名单程序，绝不执行带路径的程序或当前目录下的脚本
+        if '/' in program or program not in HELP_TOOLS:
+            return []
+        if not os.path.isabs(path) or os.path.dirname(os.path.realpath(path)) == os.path.realpath(os.getcwd()):
+            return []
+        name = program
+        long_options = [arg.split('=', 1)[0] for arg in args
+                        if arg.startswith('--') and len(arg) > 2]
+        if not long_options:
+            return []
+        supported = self._help_options(path)
+        if supported is None:
+            return []
+        return [ValidationIssue(f"{name} 可能不支持选项 {option}", fatal=False)
+                for option in long_options if option not in supported]
+
+    def _help_options(self, path: str) -> Optional[set]:
+        """获取程序 --help 输出中的长选项，结果按程序路径和修改时间缓存"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            cache = self._load_cache()
+            entry = cache.get(path)
+            if entry and entry.get('mtime') == mtime and entry.get('version') == HELP_CACHE_VERSION:
+                options = entry.get('options')
+                return set(options) if options is not None else None
+
+        options = None
+        try:
+            result = subprocess.run(
+                [path, '--help'],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                timeout=2,
+                env=dict(os.environ, LC_ALL='C', PAGER='cat', MANPAGER='cat')
+            )
+            output = result.stdout + result.stderr
+            found = sorted(set(re.findall(r'--[A-Za-z0-9][\w-]*', output)))
+            if len(found) >= MIN_HELP_OPTIONS:
+                options = found
+            elif not found and re.match(r'^\s*usage:', output, re.IGNORECASE | re.MULTILINE):
+                # BSD 工具的 usage 行列出了全部选项，没有长选项说明确实不支持
+                options = []
+            # 其他情况看起来不是完整的选项列表，不做选项检查
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.logger.debug(f"获取 {path} 帮助信息失败: {e}")
+
+        with self._lock:
+            self._cache[path] = {'mtime': mtime, 'version': HELP_CACHE_VERSION, 'options': options}
+            self._cache_dirty = True
+        return set(options) if options is not None else None
+
+    def _load_cache(self) -> Dict:
+        """加载磁盘上的帮助信息缓存"""
+        if self._cache is None:
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self._cache = json.load(f)
+            except (OSError, ValueError):
+                self._cache = {}
+        return self._cache
+
+    def save_cache(self):
+        """把新获取的帮助信息写回磁盘缓存"""
+        with self._lock:
+            if not self._cache_dirty:
+                return
+            try:
+                with open(self.cache_file, 'w', encoding='utf-8') as f:
+                    json.dump(self._cache, f)
+                self._cache_dirty = False
+            except OSError as e:
+                self.logger.warning(f"写入帮助信息缓存失败: {e}")
+
+    @staticmethod
+    def correction_prompt(results: Dict[str, List[ValidationIssue]]) -> str:
+        """根据校验结果中的确定错误生成修正请求"""
+        lines = ["你给出的以下命令在我的系统上本地校验失败，请修正后重新给出，保持相同的JSON格式："]
+        for command, issues in results.items():
+            if has_errors(issues):
+                lines.append(f"- {command}")
+                lines.extend(f"  - {issue.message}" for issue in issues if issue.fatal)
+        return '\n'.join(lines)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+# 出现即意味着查询较复杂的工具
+COMPLEX_TOOLS = {
+    'awk', 'sed', 'jq', 'xargs', 'find', 'perl', 'grep', 'sort', 'uniq',
+    'cut', 'tr', 'rsync', 'ssh', 'iptables', 'systemctl', 'docker',
+    'kubectl', 'git', 'ffmpeg', 'openssl', 'tar', 'crontab', 'powershell'
+}
+
+# 描述多步骤操作的关键词
+COMPLEX_HINTS = [
+    '|', '&&', '管道', '然后', '并且', '同时', '批量', '递归', '正则',
+    '脚本', '循环', '统计', '排序', '过滤', '替换', '定时'
+]
+
+
+class ModelRouter:
+    def __init__(self, default_model: str):
+        """初始化模型路由器
+
+        Args:
+            default_model: 未配置快/强模型时使用的默认模型
+        """
+        self.logger = logging.getLogger(__name__)
+        self.enabled = os.getenv('ROUTER_ENABLED', 'false').lower() == 'true'
+        self.fast_model = os.getenv('FAST_MODEL_NAME') or default_model
+        self.strong_model = os.getenv('STRONG_MODEL_NAME') or default_model
+        try:
+            self.threshold = float(os.getenv('ROUTER_THRESHOLD', '3'))
+        except ValueError:
+            self.threshold = 3.0
+        aido_home = os.environ.get('AIDO_HOME') or os.path.dirname(os.path.abspath(__file__))
+        self.log_file = os.path.join(aido_home, '.route_log.jsonl')
+
+    def score(self, query: str, depth: int = 0) -> Tuple[float, List[str]]:
+        """在本地估算查询复杂度
+
+        Args:
+            query: 用户查询
+            depth: 当前对话中已有的用户轮数
+
+        Returns:
+            (复杂度分数, 检测到的工具列表)
+        """
+        words = set(re.findall(r'[A-Za-z][\w.-]*', query.lower()))
+        tools = sorted(words & COMPLEX_TOOLS)
+
+        score = min(len(query) / 30, 3.0)
+        score += len(tools)
+        score += sum(1 for hint in COMPLEX_HINTS if hint in query)
+        score += min(depth * 0.5, 2.0)
+        return round(score, 2), tools
+
+    def route(self, query: str, depth: int = 0) -> Dict:
+        """为查询选择模型
+
+        Returns:
+            路由决策，包含 model、tier、score 和 tools
+        """
+        score, tools = self.score(query, depth)
+        tier = 'strong' if score >= self.threshold else 'fast'
+        decision = {
+            'model': self.strong_model if tier == 'strong' else self.fast_model,
+            'tier': tier,
+            'score': score,
+            'tools': tools,
+            'depth': depth,
+            'query_length': len(query),
+        }
+        self.logger.debug(f"路由决策: {decision}")
+        return decision
+
+    def escalate(self, decision: Dict) -> Optional[Dict]:
+        """快模型输出无效时升级到强模型
+
+        Returns:
+            升级后的决策；已经是强模型时返回 None
+        """
+        if decision['tier'] == 'strong' or self.strong_model == self.fast_model:
+            return None
+        escalated = dict(decision, model=self.strong_model, tier='strong', escalated=True)
+        self.logger.info(f"快模型输出无效，升级到 {self.strong_model}")
+        return escalated
+
+    def record(self, decision: Dict, latency: float, valid: bool):
+        """记录路由决策，便于根据真实延迟调整阈值"""
+        entry = dict(decision, latency=round(latency, 3), valid=valid, time=time.time())
+        try:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            self.logger.warning(f"写入路由日志失败: {e}")
+
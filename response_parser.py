@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import os
+import json
+import logging
+import threading
+from collections import Counter
+from typing import List, NamedTuple, Optional
+from urllib.parse import urlparse
+
+# 已知支持 response_format={"type": "json_object"} 的服务
+JSON_MODE_HOSTS = ('api.deepseek.com', 'api.openai.com')
+
+
+class Suggestion(NamedTuple):
+    command: str
+    explanation: str
+
+
+class ParsedResponse(NamedTuple):
+    suggestions: List[Suggestion]
+    raw: str
+    text: str = ''
+    # 解析方式：structured、tolerant 或 failed；API 调用失败时为 error，其他非模型回复时为空
+    status: str = ''
+
+    @property
+    def commands(self) -> List[str]:
+        """所有非空的命令"""
+        return [s.command for s in self.suggestions if s.command]
+
+
+def supports_json_mode(base_url: str) -> bool:
+    """判断服务是否支持 JSON 模式
+
+    STRUCTURED_OUTPUT 可设为 true/false 强制开关，默认 auto 按服务地址判断。
+    """
+    setting = os.getenv('STRUCTURED_OUTPUT', 'auto').lower()
+    if setting in ('true', 'false'):
+        return setting == 'true'
+    host = urlparse(base_url).hostname or ''
+    return host in JSON_MODE_HOSTS
+
+
+class ResponseParser:
+    def __init__(self):
+        """初始化响应解析器"""
+        self.logger = logging.getLogger(__name__)
+        # structured: JSON 模式直接解析成功；tolerant: 需要容错解析；failed: 未解析出任何命令
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def parse(self, message: Optional[str]) -> ParsedResponse:
+        """把模型回复解析为统一的建议列表
+
+        优先按 {"commands": [...]} 结构解析，失败时容错处理代码块、
+        多个拼接的 JSON 对象以及夹杂的说明文字。
+        """
+        message = (message or '').strip()
+        try:
+            suggestions = self._to_suggestions(json.loads(message))
+        except json.JSONDecodeError:
+            suggestions = None
+        if suggestions:
+            return ParsedResponse(suggestions, message, status=self._count('structured'))
+
+        suggestions, text = self._parse_tolerant(message)
+        status = self._count('tolerant' if suggestions else 'failed')
+        if not suggestions:
+            self.logger.warning(f"无法解析模型回复（累计 {self.stats['failed']} 次）: {message[:200]}")
+        return ParsedResponse(suggestions, message, text, status)
+
+    def _count(self, status: str) -> str:
+        """累计各解析方式的次数，多候选模式下会在多个线程中调用"""
+        with self._lock:
+            self.stats[status] += 1
+        return status
+
+    def _to_suggestions(self, data) -> List[Suggestion]:
+        """把已解析的 JSON 数据转换为建议列表"""
+        if isinstance(data, dict) and isinstance(data.get('commands'), list):
+            data = data['commands']
+        if isinstance(data, dict):
+            data = [data]
+        if not isinstance(data, list):
+            return []
+        suggestions = []
+        for item in data:
+            if isinstance(item, dict) and 'command' in item:
+                suggestions.append(Suggestion(
+                    str(item.get('command') or ''),
+                    str(item.get('explanation') or '')
+                ))
+        return suggestions
+
+    def _parse_tolerant(self, message: str):
+        """从任意文本中找出所有 JSON 对象，其余内容作为普通文本保留
+
+        Returns:
+            (建议列表, 未能解析的文本)
+        """
+        decoder = json.JSONDecoder()
+        suggestions, leftovers = [], []
+        pos = 0
+        while pos < len(message):
+            start = message.find('{', pos)
+            if start < 0:
+                leftovers.append(message[pos:])
+                break
+            try:
+                data, end = decoder.raw_decode(message, start)
+            except json.JSONDecodeError:
+                leftovers.append(message[pos:start + 1])
+                pos = start + 1
+                continue
+            found = self._to_suggestions(data)
+            if found:
+                leftovers.append(message[pos:start])
+                suggestions.extend(found)
+            else:
+                leftovers.append(message[pos:end])
+            pos = end
+
+        # 去掉 markdown 代码块标记后剩余的文字
+        text = '\n'.join(
+            line for line in ''.join(leftovers).splitlines()
+            if not line.strip().startswith('```')
+        ).strip()
+        return suggestions, text
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+import os
+import re
+import logging
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+from typing import IO, Iterable, Iterator, List, Optional
+from rich.console import Console
+from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+
+# 系统提示保持不变，用户问题放在用户消息开头，使同一批分块共享尽可能长的缓存前缀
+MAP_PROMPT = """你是日志和命令输出分析专家。用户会给出一个问题和通过管道输入的数据中的一个片段。
+请只提取与用户问题相关的关键信息（错误、异常、服务名、路径、数值等），尽量简短，使用要点列表。
+如果该片段与问题无关，只回复“无”。"""
+
+FOLD_PROMPT = """用户会给出一个问题和从多个数据片段中提取出的信息，请合并去重，保留与用户问题相关的关键信息，尽量简短。"""
+
+NO_FINDINGS = "无"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+class StdinReducer:
+    def __init__(self, client, model: str, query: str,
+                 pattern: Optional[str] = None, dedup: bool = False, usage=None):
+        """初始化标准输入分块处理器
+
+        Args:
+            client: OpenAI 客户端
+            model: 处理分块时使用的模型
+            query: 用户问题
+            pattern: 本地预过滤的正则表达式，只保留匹配的行
+            dedup: 是否丢弃重复的行
+            usage: 记录 token 用量的 UsageTracker
+        """
+        self.console = Console()
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.model = model
+        self.query = query
+        self.usage = usage
+        pattern = pattern or os.getenv('STDIN_FILTER')
+        self.pattern = re.compile(pattern) if pattern else None
+        self.dedup = dedup or os.getenv('STDIN_DEDUP', 'false').lower() == 'true'
+        self.chunk_chars = _env_int('STDIN_CHUNK_CHARS', 12000)
+        self.concurrency = _env_int('STDIN_CONCURRENCY', 4)
+        self.dedup_window = _env_int('STDIN_DEDUP_WINDOW', 10000)
+        self.lines_read = 0
+        self.lines_kept = 0
+        self.lines_split = 0
+        self.chunks_total = 0
+        self.chunks_failed = 0
+
+    def _read_lines(self, stream: IO[str]) -> Iterator[str]:
+        """逐行读取输入，每次最多读取一个分块大小
+
+        超长的行（例如压缩过的 JSON）会被拆成多段，保证内存占用有上限。
+        """
+        continued = False
+        while True:
+            piece = stream.readline(self.chunk_chars)
+            if not piece:
+                break
+            if not continued:
+                self.lines_read += 1
+            split = not piece.endswith('\n') and len(piece) >= self.chunk_chars
+            if split and not continued:
+                self.lines_split += 1
+            continued = split
+            yield piece
+
+    def _filter_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """本地预过滤：正则匹配和去重，减少发送的 token"""
+        seen = OrderedDict()
+        starts_line = True
+        for line in lines:
+            # 超长行被拆成多段时，只按行首那一段计数
+            is_line_start = starts_line
+            starts_line = line.endswith('\n') or len(line) < self.chunk_chars
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            if self.pattern and not self.pattern.search(line):
+                continue
+            if self.dedup:
+                # 只记住最近的行摘要，保证内存占用有上限
+                key = hashlib.md5(line.encode('utf-8', 'replace')).digest()
+                if key in seen:
+                    seen.move_to_end(key)
+                    continue
+                seen[key] = None
+                if len(seen) > self.dedup_window:
+                    seen.popitem(last=False)
+            if is_line_start:
+                self.lines_kept += 1
+            yield line
+
+    def iter_chunks(self, stream: IO[str]) -> Iterator[str]:
+        """把输入按字符预算切成适合模型上下文的分块"""
+        chunk: List[str] = []
+        size = 0
+        for line in self._filter_lines(self._read_lines(stream)):
+            if chunk and size + len(line) + 1 > self.chunk_chars:
+                yield '\n'.join(chunk)
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line) + 1
+        if chunk:
+            yield '\n'.join(chunk)
+
+    def _complete(self, system_prompt: str, content: str) -> str:
+        """调用模型处理单个分块"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"用户问题：{self.query}\n\n{content}"}
+            ],
+            temperature=0.3,
+            stream=False
+        )
+        if self.usage:
+            self.usage.record(self.model, getattr(response, 'usage', None))
+        return (response.choices[0].message.content or '').strip()
+
+    def _map_chunk(self, chunk: str) -> str:
+        """提取单个分块中与问题相关的信息"""
+        return self._complete(MAP_PROMPT, f"数据片段：\n{chunk}")
+
+    def _fold(self, findings: List[str]) -> List[str]:
+        """合并已有的结论，使其总长度保持在一个分块之内"""
+        merged = self._complete(FOLD_PROMPT, "提取出的信息：\n" + '\n\n'.join(findings))
+        return [merged[:self.chunk_chars]]
+
+    def _collect(self, findings: List[str], result: str) -> List[str]:
+        """收集一个分块的结论，超过预算时先行归并
+
+        归并失败时丢弃最早的结论，保证总长度始终不超过一个分块。
+        """
+        if not result or result == NO_FINDINGS:
+            return findings
+        collected = findings + [result[:self.chunk_chars]]
+        if sum(len(f) for f in collected) <= self.chunk_chars:
+            return collected
+        try:
+            return self._fold(collected)
+        except Exception as e:
+            self.logger.warning(f"归并分块结论失败，丢弃较早的结论: {e}")
+        while len(collected) > 1 and sum(len(f) for f in collected) > self.chunk_chars:
+            collected.pop(0)
+        return collected
+
+    def _report(self):
+        """提示被拆分到多个分块的超长行"""
+        if self.lines_split:
+            self.console.print(
+                f"[dim]其中 {self.lines_split} 行超过 {self.chunk_chars} 个字符，已拆分到多个分块[/dim]"
+            )
+
+    def reduce(self, stream: IO[str]) -> str:
+        """并发处理所有分块并归并为最终的上下文
+
+        输入只有一个分块时直接返回原文，不额外调用模型。
+
+        Returns:
+            附加到用户问题后面的上下文文本
+
+        Raises:
+            Exception: 所有分块都处理失败时抛出，避免把失败当作“无相关信息”
+        """
+        chunks = self.iter_chunks(stream)
+        first = next(chunks, None)
+        if first is None:
+            return ''
+        second = next(chunks, None)
+        if second is None:
+            self._report()
+            return first
+
+        findings: List[str] = []
+        first_error: Optional[Exception] = None
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[cyan]分析输入数据"),
+            TextColumn("已完成 {task.completed} 块 · 已读取 {task.fields[lines]} 行"),
+            TimeElapsedColumn(),
+            console=self.console,
+            transient=True
+        ) as progress, ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            task = progress.add_task("map", total=None, lines=self.lines_read)
+            pending = {executor.submit(self._map_chunk, first),
+                       executor.submit(self._map_chunk, second)}
+
+            def drain(return_when):
+                nonlocal pending, findings, first_error
+                done, pending = wait(pending, return_when=return_when)
+                for future in done:
+                    self.chunks_total += 1
+                    progress.update(task, advance=1, lines=self.lines_read)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.chunks_failed += 1
+                        first_error = first_error or e
+                        self.logger.warning(f"分块处理失败: {e}")
+                        continue
+                    findings = self._collect(findings, result)
+
+            # 同时在途的分块数量受并发上限约束，内存占用与输入大小无关
+            for chunk in chunks:
+                while len(pending) >= self.concurrency:
+                    drain(FIRST_COMPLETED)
+                pending.add(executor.submit(self._map_chunk, chunk))
+                progress.update(task, lines=self.lines_read)
+            drain(ALL_COMPLETED)
+
+        self.console.print(
+            f"[dim]输入共 {self.lines_read} 行，预过滤后保留 {self.lines_kept} 行[/dim]"
+        )
+        self._report()
+        if self.chunks_failed == self.chunks_total:
+            raise Exception(f"管道输入的 {self.chunks_total} 个分块全部处理失败: {first_error}")
+        context = '\n\n'.join(findings) if findings else NO_FINDINGS
+        if self.chunks_failed:
+            self.console.print(
+                f"[yellow]{self.chunks_failed}/{self.chunks_total} 个分块处理失败，分析结果不完整[/yellow]"
+            )
+            context += f"\n\n（注意：{self.chunks_failed}/{self.chunks_total} 个数据分块处理失败，以上信息不完整）"
+        return context
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+
+def cached_prompt_tokens(usage) -> Optional[int]:
+    """读取服务返回的缓存命中 token 数
+
+    DeepSeek 使用 usage.prompt_cache_hit_tokens，OpenAI 兼容服务使用
+    usage.prompt_tokens_details.cached_tokens；都没有时返回 None。
+    """
+    hit = getattr(usage, 'prompt_cache_hit_tokens', None)
+    if hit is None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        hit = getattr(details, 'cached_tokens', None) if details else None
+    return hit
+
+
+class UsageTracker:
+    def __init__(self, console=None):
+        """初始化用量统计
+
+        Args:
+            console: 用于显示每次请求缓存命中情况的 rich Console
+        """
+        self.logger = logging.getLogger(__name__)
+        self.console = console
+        self.show = os.getenv('SHOW_CACHE_STATS', 'false').lower() == 'true'
+        aido_home = os.environ.get('AIDO_HOME') or os.path.dirname(os.path.abspath(__file__))
+        self.log_file = os.path.join(aido_home, '.usage_log.jsonl')
+        self.totals = {'prompt_tokens': 0, 'cached_tokens': 0, 'requests': 0, 'parse_failed': 0}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, usage, parse_status: Optional[str] = None) -> Dict:
+        """记录一次请求的 token 用量、缓存命中情况和回复解析结果
+
+        Args:
+            model: 请求使用的模型
+            usage: 服务返回的 usage，未返回时为 None
+            parse_status: 回复的解析方式（structured/tolerant/failed），不需要解析的请求为 None
+
+        Returns:
+            记录的条目
+        """
+        entry = {
+            'time': time.time(),
+            'model': model,
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+            'cached_tokens': cached_prompt_tokens(usage) if usage is not None else None,
+        }
+        if parse_status:
+            entry['parse'] = parse_status
+        with self._lock:
+            self.totals['requests'] += 1
+            self.totals['prompt_tokens'] += entry['prompt_tokens']
+            self.totals['cached_tokens'] += entry['cached_tokens'] or 0
+            if parse_status == 'failed':
+                self.totals['parse_failed'] += 1
+            try:
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError as e:
+                self.logger.warning(f"写入用量日志失败: {e}")
+
+        self.logger.info(f"token 用量: {entry}")
+        if self.show and self.console and entry['cached_tokens'] is not None:
+            self.console.print(
+                f"[dim]缓存命中 {entry['cached_tokens']}/{entry['prompt_tokens']} tokens"
+                f"（本次会话累计命中率 {self.hit_rate():.0%}）[/dim]"
+            )
+        if parse_status == 'failed' and self.console:
+            self.console.print("[dim]模型回复格式无法解析，已记录到用量日志[/dim]")
+        return entry
+
+    def hit_rate(self) -> float:
+        """本次会话的提示缓存命中率"""
+        if not self.totals['prompt_tokens']:
+            return 0.0
+        return self.totals['cached_tokens'] / self.totals['prompt_tokens']